@@ -1,13 +1,23 @@
 # lambda_etl.py
-import os
+"""
+CoinGecko -> S3 ETL Lambda (container image entry point: lambda_etl.lambda_handler).
+
+This file is the only copy of the ETL handler; the Dockerfile copies it into the image
+as-is, so keep a single definition of each function here.
+"""
 import logging
-from datetime import datetime
-import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 
-import awswrangler as wr
-import pandas as pd
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
-import boto3
+import s3fs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # -------------------------------
 # Logging
@@ -19,13 +29,107 @@ logger.setLevel(logging.INFO)
 # Constants
 # -------------------------------
 BITCOIN_ID = "bitcoin"
+# (CoinGecko /coins/markets field, output column); *_usd columns are cast to float
+_FIELD_MAP = (
+    ("id", "id"),
+    ("symbol", "symbol"),
+    ("name", "name"),
+    ("current_price", "price_usd"),
+    ("total_volume", "volume_usd"),
+    ("market_cap", "market_cap_usd"),
+    ("last_updated", "last_updated"),
+)
+# CoinGecko's usual last_updated layout; anything else goes through datetime.fromisoformat
+_ISO8601_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{3})?(Z|\+00:00)\Z")
+SECRETS_EXTENSION_PORT = os.environ.get("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", "2773")
+# Retry budget sized so the CoinGecko fetch always finishes inside the 60s Lambda timeout:
+# worst case is 3 attempts x (3.05s connect + 10s read) + 2 waits capped at 5s each ~= 49s
+HTTP_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+MAX_RETRIES = 2
+RETRY_BACKOFF_BASE = 1   # seconds; urllib3 sleeps 0s, then base * 2**(n-1), between attempts
+RETRY_AFTER_MAX = 5      # cap on a server-sent Retry-After (urllib3 default is 6 hours)
+
+# -------------------------------
+# HTTP session (reused across warm invocations)
+# -------------------------------
+# urllib3 retries 429/5xx at the transport level, honoring CoinGecko's Retry-After header.
+# Only https:// is mounted, so the loopback secrets extension call is never retried.
+_RETRY = Retry(
+    total=MAX_RETRIES,
+    status_forcelist=[429, 500, 502, 503, 504],
+    backoff_factor=RETRY_BACKOFF_BASE,
+    respect_retry_after_header=True,
+    retry_after_max=RETRY_AFTER_MAX,
+    backoff_max=RETRY_AFTER_MAX,
+    allowed_methods={"GET"},
+    raise_on_status=False  # hand the last response back so raise_for_status() reports it
+)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=_RETRY))
+
+# -------------------------------
+# Container-scoped state (persists across warm invocations)
+# -------------------------------
+_API_KEY: Optional[str] = None
+
+_S3FS: Optional[s3fs.S3FileSystem] = None
+
+# Fixed output schema so PyArrow never has to infer column types
+_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("symbol", pa.string()),
+    ("name", pa.string()),
+    ("price_usd", pa.float64()),
+    ("volume_usd", pa.float64()),
+    ("market_cap_usd", pa.float64()),
+    ("last_updated", pa.timestamp("us", tz="UTC")),
+    ("date", pa.date32()),
+    ("processing_timestamp", pa.timestamp("us", tz="UTC")),
+])
+# year/month/day are not stored in the file; they are encoded in the Hive-style object key
+
+# -------------------------------
+# Retrieve API key via the Parameters and Secrets Lambda Extension
+# -------------------------------
+def _load_secret(secret_id: str) -> Optional[str]:
+    """
+    Reads the CoinGecko API key through the extension's local HTTP cache instead of a
+    signed Secrets Manager call.
+    """
+    resp = _SESSION.get(
+        f"http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get",
+        params={"secretId": secret_id},
+        headers={"X-Aws-Parameters-Secrets-Token": os.environ["AWS_SESSION_TOKEN"]},
+        timeout=1
+    )
+    resp.raise_for_status()
+    return orjson.loads(orjson.loads(resp.content)["SecretString"]).get("COINGECKO_API_KEY")
+
+# -------------------------------
+# Timestamp parsing
+# -------------------------------
+def _parse_iso8601(s: str) -> datetime:
+    """
+    Parses CoinGecko's usual `YYYY-MM-DDTHH:MM:SS[.sss]Z` timestamps by slicing, falling back to
+    datetime.fromisoformat for any other layout. Returns an aware UTC datetime (naive input is taken as UTC).
+    """
+    if not _ISO8601_RE.match(s):
+        dt = datetime.fromisoformat(s)
+        return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+    micros = int(s[20:23]) * 1000 if s[19] == "." else 0
+    return datetime(
+        int(s[0:4]), int(s[5:7]), int(s[8:10]),
+        int(s[11:13]), int(s[14:16]), int(s[17:19]),
+        micros, tzinfo=timezone.utc
+    )
 
 # -------------------------------
 # Fetch current market data from CoinGecko
 # -------------------------------
-def fetch_single_coin_market_data(coin_id: str, api_key: str = None) -> pd.DataFrame:
+def fetch_single_coin_market_data(coin_id: str, api_key: str = None) -> Optional[Dict[str, Any]]:
     """
     Fetches current market data for a single cryptocurrency from CoinGecko and maps it to our schema.
+    Returns the mapped row, or None if CoinGecko returned nothing.
     """
     logger.info(f"Fetching market data for coin ID: {coin_id}")
     url = "https://api.coingecko.com/api/v3/coins/markets"
@@ -39,49 +143,70 @@ def fetch_single_coin_market_data(coin_id: str, api_key: str = None) -> pd.DataF
     }
     headers = {"x-cg-api-key": api_key} if api_key else {}
 
-    resp = requests.get(url, params=params, headers=headers, timeout=30)
+    resp = _SESSION.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
     resp.raise_for_status()
-    data = resp.json()
+    data = orjson.loads(resp.content)
     if not data:
         logger.warning(f"No data returned for {coin_id}")
-        return pd.DataFrame()
+        return None
 
-    df = pd.DataFrame(data)
-    df = df.assign(
-        price_usd=df["current_price"].astype(float),
-        volume_usd=df["total_volume"].astype(float),
-        market_cap_usd=df["market_cap"].astype(float)
-    )
-    df = df[["id", "symbol", "name", "price_usd", "volume_usd", "market_cap_usd", "last_updated"]]
-    return df
+    row = data[0]
+    out = {
+        dst: (float(row[src]) if row[src] is not None else None) if dst.endswith("_usd") else row[src]
+        for src, dst in _FIELD_MAP
+    }
+    out["last_updated"] = _parse_iso8601(out["last_updated"]) if out["last_updated"] else None
+    return out
+
+# -------------------------------
+# Write a single row to S3
+# -------------------------------
+def _write_row(row: Dict[str, Any], bucket: str, prefix: str, run_date: datetime) -> str:
+    """
+    Replaces the day's year/month/day partition with a single Parquet object holding this row,
+    with no pandas round trip. Returns the object's S3 URI.
+    """
+    global _S3FS
+    if _S3FS is None:
+        _S3FS = s3fs.S3FileSystem()
+
+    table = pa.Table.from_pydict({k: [v] for k, v in row.items()}, schema=_SCHEMA)
+    partition_dir = f"{bucket}/{prefix}/year={run_date.year}/month={run_date.month}/day={run_date.day}"
+    # Same semantics as the backfill's delete_matching: clear the partition first so files from
+    # other writers (e.g. awswrangler's uuid-named objects) can't double-count the day
+    if _S3FS.exists(partition_dir):
+        _S3FS.rm(partition_dir, recursive=True)
+    path = f"{partition_dir}/part-0.parquet"
+    pq.write_table(table, path, filesystem=_S3FS, compression="snappy")
+    return f"s3://{path}"
 
 # -------------------------------
 # Lambda handler
 # -------------------------------
 def lambda_handler(event, context):
+    global _API_KEY
     try:
         # Environment variables
         s3_bucket = os.environ["S3_BUCKET"]
         s3_prefix = os.environ["S3_PREFIX"]
         api_key_secret_name = os.environ.get("COINGECKO_API_KEY_SECRET_NAME")
 
-        # Retrieve API key from Secrets Manager (optional)
-        api_key = None
-        if api_key_secret_name:
+        # Retrieve API key via the secrets extension (optional, cached across warm invocations)
+        if _API_KEY is None and api_key_secret_name:
             try:
-                secrets_client = boto3.client("secretsmanager")
-                secret_value = secrets_client.get_secret_value(SecretId=api_key_secret_name)
-                api_key = json.loads(secret_value["SecretString"]).get("COINGECKO_API_KEY")
-                logger.info("Retrieved CoinGecko API key from Secrets Manager")
+                _API_KEY = _load_secret(api_key_secret_name)
+                logger.info("Retrieved CoinGecko API key from Secrets Manager extension")
             except Exception as e:
                 logger.warning(f"Could not retrieve API key: {e}. Proceeding without key.")
+        api_key = _API_KEY
 
         # Determine run date
+        now = datetime.now(timezone.utc)
         if "date" in event:
             run_date = datetime.strptime(event["date"], "%Y-%m-%d")
             logger.info(f"Backfill mode for {event['date']}")
         else:
-            run_date = datetime.utcnow()
+            run_date = now
             logger.info("Live mode")
 
         # If historical data provided, STRICTLY use it (no fallback)
@@ -96,46 +221,34 @@ def lambda_handler(event, context):
                 logger.error(f"Historical data missing price for {event.get('date')}. Aborting write.")
                 return {"statusCode": 400, "body": "Historical data missing price_usd"}
 
-            # Build dataframe from historical data (single row)
-            df = pd.DataFrame([{
+            # Build row from historical data
+            row = {
                 "id": "bitcoin",
                 "symbol": "btc",
                 "name": "Bitcoin",
                 "price_usd": float(price),
                 "volume_usd": float(volume) if volume is not None else None,
                 "market_cap_usd": float(market_cap) if market_cap is not None else None,
-                "last_updated": f"{event.get('date')}T00:00:00Z"
-            }])
+                "last_updated": run_date.replace(tzinfo=timezone.utc)  # midnight UTC of the backfilled day
+            }
 
         else:
             # Live mode: fetch current snapshot
-            df = fetch_single_coin_market_data(BITCOIN_ID, api_key=api_key)
-            if df.empty:
+            row = fetch_single_coin_market_data(BITCOIN_ID, api_key=api_key)
+            if row is None:
                 logger.error("No data returned from CoinGecko in live mode. Aborting.")
                 return {"statusCode": 204, "body": "No data returned from API"}
 
-        # Add date and partition columns
+        # Add date column (partition values come from run_date via the object key)
         # Store `date` as date (not full timestamp) to match Athena DATE semantics
-        df["date"] = pd.to_datetime(run_date).normalize()
-        df["year"] = int(run_date.year)
-        df["month"] = int(run_date.month)
-        df["day"] = int(run_date.day)
-        df["processing_timestamp"] = datetime.utcnow()
-
-        # S3 path
-        s3_path = f"s3://{s3_bucket}/{s3_prefix}"
-
-        # Write to S3 using awswrangler (overwrite partition for that day)
-        result = wr.s3.to_parquet(
-            df=df,
-            path=s3_path,
-            dataset=True,
-            partition_cols=["year", "month", "day"],
-            mode="overwrite_partitions"
-        )
-
-        logger.info(f"Wrote {len(result.get('paths', []))} files to {s3_path}")
-        return {"statusCode": 200, "body": f"Data written to {result.get('paths', [s3_path])[0]}"}
+        row["date"] = run_date.date()
+        row["processing_timestamp"] = now
+
+        # Write to S3 (overwrite partition for that day)
+        s3_path = _write_row(row, s3_bucket, s3_prefix, run_date)
+
+        logger.info(f"Wrote 1 file to {s3_path}")
+        return {"statusCode": 200, "body": f"Data written to {s3_path}"}
 
     except Exception as e:
         logger.exception(f"Error in lambda_handler: {e}")
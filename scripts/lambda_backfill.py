@@ -6,19 +6,29 @@ to S3 in the same layout as the ETL Lambda:
 s3://aws-crypto-pipeline-data-lake-2025/raw/coingecko/{year}/{month}/{day}/...
 
 This bypasses Lambda for backfill, but produces identical files so Athena will read them.
+
+Install its dependencies first (httpx needs the http2 extra for h2):
+
+    pip install -r scripts/requirements.txt
 """
 
 import os
+import argparse
+import asyncio
 import time
-import json
 import logging
+import re
+from collections import deque
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
 
 import boto3
-import requests
-import pandas as pd
-import awswrangler as wr
+import httpx
+import msgspec
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import s3fs
 
 # -------- CONFIG ----------
 BUCKET = "aws-crypto-pipeline-data-lake-2025"
@@ -29,20 +39,88 @@ AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 SECRET_NAME = os.environ.get("COINGECKO_API_KEY_SECRET_NAME")  # name or ARN in Secrets Manager
 
 # Rate-limit settings (CoinGecko free tier ~ 30/minute)
-DELAY_BETWEEN_REQUESTS = float(os.environ.get("DELAY_BETWEEN_REQUESTS", "3.0"))
+RATE_LIMIT_CALLS = int(os.environ.get("RATE_LIMIT_CALLS", "25"))       # requests allowed...
+RATE_LIMIT_PERIOD = float(os.environ.get("RATE_LIMIT_PERIOD", "60"))   # ...per this many seconds
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "4"))              # concurrent requests on the HTTP/2 connection
 MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "6"))
 RETRY_BACKOFF_BASE = int(os.environ.get("RETRY_BACKOFF_BASE", "5"))  # seconds multiplier
 
+# Per-day files are a few KB each, so they are uploaded as concurrent single PUTs
+S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", "16"))
+
 # Backfill date range settings: either DAYS or START_DATE/END_DATE
 DAYS = int(os.environ.get("DAYS", "90"))  # fallback if START/END not provided
 START_DATE = os.environ.get("START_DATE")  # YYYY-MM-DD
 END_DATE = os.environ.get("END_DATE")      # YYYY-MM-DD
 
+# Days already written by earlier runs (one YYYY-MM-DD per line); resumed backfills skip them.
+# One file per destination, kept next to this script so it doesn't depend on the cwd.
+DONE_FILE = os.environ.get("BACKFILL_DONE_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache",
+    f"backfill-{BUCKET}-{PREFIX.replace('/', '_')}-{COIN_ID}.done"
+)
+
+# CoinGecko's usual last_updated layout; anything else goes through datetime.fromisoformat
+_ISO8601_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{3})?(Z|\+00:00)\Z")
+
+# Output schema (kept in sync with lambda/src/lambda_etl.py)
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("symbol", pa.string()),
+    ("name", pa.string()),
+    ("price_usd", pa.float64()),
+    ("volume_usd", pa.float64()),
+    ("market_cap_usd", pa.float64()),
+    ("last_updated", pa.timestamp("us", tz="UTC")),
+    ("date", pa.date32()),
+    ("year", pa.int32()),
+    ("month", pa.int32()),
+    ("day", pa.int32()),
+    ("processing_timestamp", pa.timestamp("us", tz="UTC")),
+])
+
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger("backfill")
 
+# ---------------- Response types ----------------
+# Only the fields we read are declared; msgspec skips everything else during decoding
+class MarketData(msgspec.Struct):
+    current_price: Dict[str, Optional[float]] = {}
+    total_volume: Dict[str, Optional[float]] = {}
+    market_cap: Dict[str, Optional[float]] = {}
+    last_updated: Optional[str] = None
+
+class CoinHistory(msgspec.Struct):
+    market_data: Optional[MarketData] = None
+    last_updated: Optional[str] = None
+
+_HISTORY_DECODER = msgspec.json.Decoder(CoinHistory)
+
 # ---------------- Helpers ----------------
+class RateLimiter:
+    """
+    Sliding-window limiter shared by all fetch tasks: at most `calls` acquisitions
+    in any `period` seconds. Callers wait until a slot frees up.
+    """
+    def __init__(self, calls: int, period: float):
+        self.calls = calls
+        self.period = period
+        self._stamps = deque()
+
+    async def acquire(self):
+        # Single event loop: nothing awaits between the check and the append, so no lock is needed
+        while True:
+            now = time.monotonic()
+            while self._stamps and now - self._stamps[0] >= self.period:
+                self._stamps.popleft()
+            if len(self._stamps) < self.calls:
+                self._stamps.append(now)
+                return
+            await asyncio.sleep(self.period - (now - self._stamps[0]))
+
+_RATE_LIMITER = RateLimiter(RATE_LIMIT_CALLS, RATE_LIMIT_PERIOD)
+
 def get_api_key_from_secrets(secret_name: Optional[str]) -> Optional[str]:
     if not secret_name:
         logger.info("No COINGECKO_API_KEY_SECRET_NAME provided; proceeding without API key.")
@@ -51,13 +129,35 @@ def get_api_key_from_secrets(secret_name: Optional[str]) -> Optional[str]:
         sm = boto3.client("secretsmanager", region_name=AWS_REGION)
         resp = sm.get_secret_value(SecretId=secret_name)
         secret_string = resp.get("SecretString", "{}")
-        payload = json.loads(secret_string)
+        payload = orjson.loads(secret_string)
         return payload.get("COINGECKO_API_KEY")
     except Exception as e:
         logger.warning(f"Could not read secret {secret_name}: {e}. Proceeding without API key.")
         return None
 
-def fetch_historical_day(date_obj: datetime, api_key: Optional[str]) -> Dict[str, Any]:
+# Same parser as lambda_etl._parse_iso8601 (kept in sync): slices the usual layout and falls
+# back to datetime.fromisoformat, normalized to UTC, for anything else
+def _parse_iso8601(s: str) -> datetime:
+    if not _ISO8601_RE.match(s):
+        dt = datetime.fromisoformat(s)
+        return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+    micros = int(s[20:23]) * 1000 if s[19] == "." else 0
+    return datetime(
+        int(s[0:4]), int(s[5:7]), int(s[8:10]),
+        int(s[11:13]), int(s[14:16]), int(s[17:19]),
+        micros, tzinfo=timezone.utc
+    )
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """
+    Seconds from a numeric Retry-After header, if CoinGecko sent one.
+    """
+    try:
+        return float(resp.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+async def fetch_historical_day(client: httpx.AsyncClient, date_obj: datetime, api_key: Optional[str]) -> Dict[str, Any]:
     """
     Fetch /coins/{id}/history?date=DD-MM-YYYY
     Returns a dict like {"date": "YYYY-MM-DD", "price_usd": float or None, "volume_usd": float or None, "market_cap_usd": float or None, "last_updated": str or None}
@@ -71,22 +171,21 @@ def fetch_historical_day(date_obj: datetime, api_key: Optional[str]) -> Dict[str
     while attempt < MAX_RETRIES:
         attempt += 1
         try:
+            await _RATE_LIMITER.acquire()
             logger.info(f"Fetching historical {COIN_ID} for {date_obj.date()} (attempt {attempt})")
-            resp = requests.get(url, params=params, headers=headers, timeout=30)
+            resp = await client.get(url, params=params, headers=headers)
             if resp.status_code == 429:
-                wait = RETRY_BACKOFF_BASE * attempt
+                wait = _retry_after(resp) or RETRY_BACKOFF_BASE * attempt
                 logger.warning(f"Rate limited (429). Sleeping {wait}s then retrying.")
-                time.sleep(wait)
+                await asyncio.sleep(wait)
                 continue
             resp.raise_for_status()
-            data = resp.json()
-            market = data.get("market_data", {}) or {}
-            price = market.get("current_price", {}).get("usd")
-            volume = market.get("total_volume", {}).get("usd")
-            mcap = market.get("market_cap", {}).get("usd")
-            last_updated = data.get("last_updated") or market.get("last_updated")
-            # Respect delay even after success
-            time.sleep(DELAY_BETWEEN_REQUESTS)
+            hist = _HISTORY_DECODER.decode(resp.content)
+            market = hist.market_data or MarketData()
+            price = market.current_price.get("usd")
+            volume = market.total_volume.get("usd")
+            mcap = market.market_cap.get("usd")
+            last_updated = hist.last_updated or market.last_updated
             return {
                 "date": date_obj.strftime("%Y-%m-%d"),
                 "price_usd": price,
@@ -94,53 +193,74 @@ def fetch_historical_day(date_obj: datetime, api_key: Optional[str]) -> Dict[str
                 "market_cap_usd": mcap,
                 "last_updated": last_updated,
             }
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             backoff = RETRY_BACKOFF_BASE * attempt
             logger.warning(f"Network error: {e}. Backing off {backoff}s (attempt {attempt}).")
-            time.sleep(backoff)
+            await asyncio.sleep(backoff)
         except Exception as e:
             logger.exception(f"Unexpected error fetching {date_obj.date()}: {e}")
-            time.sleep(RETRY_BACKOFF_BASE * attempt)
+            await asyncio.sleep(RETRY_BACKOFF_BASE * attempt)
 
     logger.error(f"Failed to fetch historical for {date_obj.date()} after {MAX_RETRIES} attempts")
     return {"date": date_obj.strftime("%Y-%m-%d"), "price_usd": None, "volume_usd": None, "market_cap_usd": None, "last_updated": None}
 
-def build_dataframe_from_payload(payload: Dict[str, Any], run_date: datetime) -> pd.DataFrame:
+def build_row_from_payload(payload: Dict[str, Any], run_date: datetime) -> Dict[str, Any]:
     """
-    Build a 1-row DataFrame matching your ETL schema.
+    Build one output row matching your ETL schema.
     Columns: id, symbol, name, price_usd, volume_usd, market_cap_usd, last_updated, date, year, month, day, processing_timestamp
     """
-    df = pd.DataFrame([{
+    row = {
         "id": COIN_ID,
         "symbol": "btc",
         "name": "Bitcoin",
         "price_usd": payload.get("price_usd"),
         "volume_usd": payload.get("volume_usd"),
         "market_cap_usd": payload.get("market_cap_usd"),
-        "last_updated": payload.get("last_updated") or run_date.isoformat(),
-        "date": run_date,  # datetime type (pyarrow/pandas will write this)
+        "last_updated": _parse_iso8601(payload["last_updated"]) if payload.get("last_updated") else run_date,
+        "date": run_date.date(),
         "year": run_date.year,
         "month": run_date.month,
         "day": run_date.day,
         "processing_timestamp": datetime.now(timezone.utc)
-    }])
-    return df
-
-def write_parquet_to_s3(df: pd.DataFrame):
-    """
-    Use awswrangler to write into dataset with partitions year/month/day
-    Same options as your lambda_etl.py
-    """
-    s3_path = f"s3://{BUCKET}/{PREFIX}"
-    # Use 'overwrite_partitions' so same-day runs replace the partition
-    logger.info(f"Writing parquet to {s3_path} partitioned by year/month/day")
-    wr.s3.to_parquet(
-        df=df,
-        path=s3_path,
-        dataset=True,
-        partition_cols=["year", "month", "day"],
-        mode="overwrite_partitions"
-    )
+    }
+    return row
+
+def build_table_from_rows(rows: List[Dict[str, Any]]) -> pa.Table:
+    """
+    Build a PyArrow Table (no pandas involved) from many days' rows, so they can be
+    written in one batch.
+    """
+    return pa.Table.from_pylist(rows, schema=SCHEMA)
+
+def write_parquet_to_s3(table: pa.Table, fs: s3fs.S3FileSystem):
+    """
+    Write one part-0.parquet per year/month/day partition, same layout as your lambda_etl.py.
+    Partitions are serialized in memory and uploaded together with fs.pipe, which issues
+    up to S3_MAX_CONCURRENCY PutObject calls at once.
+    """
+    root_path = f"{BUCKET}/{PREFIX}"
+    groups: Dict[tuple, List[int]] = {}
+    for i, key in enumerate(zip(*(table[c].to_pylist() for c in ("year", "month", "day")))):
+        groups.setdefault(key, []).append(i)
+    # year/month/day live in the object key, not in the file
+    data = table.drop_columns(["year", "month", "day"])
+
+    files = {}
+    for (year, month, day), indices in groups.items():
+        buf = pa.BufferOutputStream()
+        pq.write_table(data.take(indices), buf, compression="snappy")
+        files[f"{root_path}/year={year}/month={month}/day={day}/part-0.parquet"] = buf.getvalue().to_pybytes()
+
+    # overwrite_partitions: clear every partition being written first, so re-runs also drop
+    # files left by older writers (e.g. awswrangler's uuid-named files). One listing, one bulk delete.
+    # List only the partitions being written, not the whole lake, so a flush costs O(batch)
+    dirs = {path.rsplit("/", 1)[0] for path in files}
+    stale = [p for d in dirs if fs.exists(d) for p in fs.find(d)]
+    if stale:
+        fs.rm(stale)
+
+    logger.info(f"Uploading {len(files)} partition files to s3://{root_path}")
+    fs.pipe(files, batch_size=S3_MAX_CONCURRENCY)
 
 # ---------------- Main ----------------
 def parse_date_range():
@@ -158,32 +278,114 @@ def parse_date_range():
         start = end - timedelta(days=DAYS - 1)
     return start, end
 
-def main():
-    api_key = get_api_key_from_secrets(SECRET_NAME)
-    start_date, end_date = parse_date_range()
-    logger.info(f"Backfilling from {start_date} to {end_date} (inclusive)")
+def daterange(start, end) -> Iterator:
+    curr = start
+    while curr <= end:
+        yield curr
+        curr = curr + timedelta(days=1)
+
+async def _process_day(
+    client: httpx.AsyncClient, sem: asyncio.Semaphore, curr, api_key: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a single day. Returns its output row, or None if no price was available.
+    """
+    run_dt = datetime(curr.year, curr.month, curr.day, tzinfo=timezone.utc)
+    async with sem:
+        payload = await fetch_historical_day(client, run_dt, api_key)
+    if payload["price_usd"] is None:
+        logger.error(f"No price for {curr}; skipping write.")
+        return None
+    try:
+        return build_row_from_payload(payload, run_dt)
+    except ValueError as e:
+        # Count the day as failed instead of aborting the whole run
+        logger.error(f"Bad payload for {curr}: {e}; skipping write.")
+        return None
+
+def load_done_days() -> set:
+    if not os.path.exists(DONE_FILE):
+        return set()
+    with open(DONE_FILE) as f:
+        return {line.strip() for line in f if line.strip()}
+
+def mark_days_done(rows: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(DONE_FILE) or ".", exist_ok=True)
+    with open(DONE_FILE, "a") as f:
+        f.writelines(f"{row['date'].isoformat()}\n" for row in rows)
+
+def _flush(rows: List[Dict[str, Any]], fs: s3fs.S3FileSystem) -> bool:
+    """
+    Write the accumulated rows in a single dataset write and record them in DONE_FILE.
+    Returns True on success.
+    """
+    try:
+        write_parquet_to_s3(build_table_from_rows(rows), fs)
+        mark_days_done(rows)
+        logger.info(f"Wrote {len(rows)} partitions ({rows[0]['date']} .. {rows[-1]['date']})")
+        return True
+    except Exception as e:
+        logger.exception(f"Failed to write parquet for {rows[0]['date']} .. {rows[-1]['date']}: {e}")
+        return False
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill CoinGecko daily data into the S3 data lake.")
+    parser.add_argument(
+        "--checkpoint", type=int, default=0, metavar="K",
+        help="Write to S3 every K fetched days instead of once at the end (bounds memory and retry scope)."
+    )
+    parser.add_argument(
+        "--no-resume", action="store_true",
+        help="Re-fetch and overwrite every day in the range, even days already recorded as written."
+    )
+    return parser.parse_args()
 
-    curr = start_date
+async def run(checkpoint: int, api_key: Optional[str], start_date, end_date, resume: bool = True):
+    fs = s3fs.S3FileSystem()
     succeeded = 0
     failed = 0
+    rows = []
 
-    while curr <= end_date:
-        run_dt = datetime(curr.year, curr.month, curr.day, tzinfo=timezone.utc)
-        payload = fetch_historical_day(run_dt, api_key)
-        if payload["price_usd"] is None:
-            logger.error(f"No price for {curr}; skipping write.")
-            failed += 1
-        else:
-            df = build_dataframe_from_payload(payload, run_dt)
-            try:
-                write_parquet_to_s3(df)
-                logger.info(f"Wrote partition for {curr} price={payload['price_usd']}")
-                succeeded += 1
-            except Exception as e:
-                logger.exception(f"Failed to write parquet for {curr}: {e}")
+    done = load_done_days() if resume else set()
+    days = [d for d in daterange(start_date, end_date) if d.isoformat() not in done]
+    if done:
+        logger.info(f"Skipping {(end_date - start_date).days + 1 - len(days)} days already recorded in {DONE_FILE}")
+
+    # One HTTP/2 connection multiplexes the in-flight requests; the semaphore caps how many
+    # are outstanding and _RATE_LIMITER keeps the overall rate under CoinGecko's cap.
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+    limits = httpx.Limits(max_keepalive_connections=4, max_connections=8)
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=30) as client:
+        tasks = [asyncio.create_task(_process_day(client, sem, d, api_key)) for d in days]
+        # Consume in date order so checkpoints cover contiguous ranges; S3 writes run off-loop
+        for task in tasks:
+            row = await task
+            if row is None:
                 failed += 1
-        curr = curr + timedelta(days=1)
+                continue
+            rows.append(row)
+            if checkpoint and len(rows) >= checkpoint:
+                if await asyncio.to_thread(_flush, rows, fs):
+                    succeeded += len(rows)
+                else:
+                    failed += len(rows)
+                rows = []
+
+    if rows:
+        if await asyncio.to_thread(_flush, rows, fs):
+            succeeded += len(rows)
+        else:
+            failed += len(rows)
+
+    return succeeded, failed
+
+def main():
+    args = parse_args()
+    api_key = get_api_key_from_secrets(SECRET_NAME)
+    start_date, end_date = parse_date_range()
+    logger.info(f"Backfilling from {start_date} to {end_date} (inclusive)")
 
+    succeeded, failed = asyncio.run(run(args.checkpoint, api_key, start_date, end_date, resume=not args.no_resume))
     logger.info(f"Backfill finished. succeeded={succeeded}, failed={failed}")
 
 if __name__ == "__main__":
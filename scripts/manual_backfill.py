@@ -1,10 +1,11 @@
 import os
 import json
 import requests
-import pandas as pd
-from datetime import datetime
-import awswrangler as wr
-import boto3
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Heavy dependencies (pyarrow, s3fs, boto3) are imported inside the functions that use them
 
 # -------------------------------
 # Configuration
@@ -13,24 +14,44 @@ BITCOIN_ID = "bitcoin"
 S3_BUCKET = os.environ.get("S3_BUCKET")        # e.g., "my-data-lake"
 S3_PREFIX = os.environ.get("S3_PREFIX", "raw/coingecko")
 API_KEY_SECRET_NAME = os.environ.get("COINGECKO_API_KEY_SECRET_NAME")
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "6"))
+RETRY_BACKOFF_BASE = int(os.environ.get("RETRY_BACKOFF_BASE", "5"))  # seconds multiplier
 
 # -------------------------------
 # Retrieve CoinGecko API key (optional)
 # -------------------------------
-api_key = None
-if API_KEY_SECRET_NAME:
-    secrets_client = boto3.client("secretsmanager")
-    secret_value = secrets_client.get_secret_value(SecretId=API_KEY_SECRET_NAME)
-    api_key = json.loads(secret_value["SecretString"])["COINGECKO_API_KEY"]
+def get_headers() -> dict:
+    api_key = None
+    if API_KEY_SECRET_NAME:
+        import boto3
+
+        secrets_client = boto3.client("secretsmanager")
+        secret_value = secrets_client.get_secret_value(SecretId=API_KEY_SECRET_NAME)
+        api_key = json.loads(secret_value["SecretString"])["COINGECKO_API_KEY"]
+
+    return {"x-cg-api-key": api_key} if api_key else {}
 
-headers = {"x-cg-api-key": api_key} if api_key else {}
+# -------------------------------
+# HTTP session (keep-alive connection pooling, transport-level retries on 429/5xx)
+# -------------------------------
+_RETRY = Retry(
+    total=MAX_RETRIES,
+    status_forcelist=[429, 500, 502, 503, 504],
+    backoff_factor=RETRY_BACKOFF_BASE,
+    respect_retry_after_header=True,
+    allowed_methods={"GET"},
+    raise_on_status=False  # hand the last response back so raise_for_status() reports it
+)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=_RETRY))
 
 # -------------------------------
 # Function to fetch Bitcoin data for a given date
 # -------------------------------
-def fetch_bitcoin_data(target_date: str):
+def fetch_bitcoin_data(target_date: str, headers: dict) -> dict:
     """
     target_date: "YYYY-MM-DD"
+    Returns one row in the ETL Lambda's output layout (see save_to_s3).
     """
     url = "https://api.coingecko.com/api/v3/coins/markets"
     params = {
@@ -43,49 +64,73 @@ def fetch_bitcoin_data(target_date: str):
         "date": target_date  # Optional; not all endpoints support historical
     }
 
-    response = requests.get(url, params=params, headers=headers)
+    response = _SESSION.get(url, params=params, headers=headers)
     response.raise_for_status()
     data = response.json()
     if not data:
         raise ValueError(f"No data returned for {target_date}")
 
     row = data[0]
-    df = pd.DataFrame([{
+    last_updated = None
+    if row["last_updated"]:
+        last_updated = datetime.fromisoformat(row["last_updated"])
+        last_updated = (last_updated.replace(tzinfo=timezone.utc) if last_updated.tzinfo is None
+                        else last_updated.astimezone(timezone.utc))
+    return {
         "id": row["id"],
         "symbol": row["symbol"],
         "name": row["name"],
         "price_usd": float(row["current_price"]),
         "volume_usd": float(row["total_volume"]),
         "market_cap_usd": float(row["market_cap"]),
-        "last_updated": row["last_updated"],
-        "date": target_date,
-        "year": int(target_date[:4]),
-        "month": int(target_date[5:7]),
-        "day": int(target_date[8:10])
-    }])
-    return df
+        "last_updated": last_updated,
+        "date": datetime.strptime(target_date, "%Y-%m-%d").date(),
+        "processing_timestamp": datetime.now(timezone.utc),
+    }
 
 # -------------------------------
 # Save to S3
 # -------------------------------
-def save_to_s3(df: pd.DataFrame):
-    s3_path = f"s3://{S3_BUCKET}/{S3_PREFIX}"
-    wr.s3.to_parquet(
-        df=df,
-        path=s3_path,
-        dataset=True,
-        partition_cols=["year", "month", "day"],
-        mode="append"
-    )
-    print(f"Saved data for {df.at[0, 'date']} to S3 at {s3_path}")
+def save_to_s3(row: dict) -> str:
+    """
+    Writes the row the same way lambda_etl._write_row does: the 9-column schema below,
+    one file per day at year=/month=/day=/part-0.parquet, clearing the partition first
+    so a rerun replaces the day instead of adding a second row.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import s3fs
+
+    # Output schema (kept in sync with lambda/src/lambda_etl.py)
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("symbol", pa.string()),
+        ("name", pa.string()),
+        ("price_usd", pa.float64()),
+        ("volume_usd", pa.float64()),
+        ("market_cap_usd", pa.float64()),
+        ("last_updated", pa.timestamp("us", tz="UTC")),
+        ("date", pa.date32()),
+        ("processing_timestamp", pa.timestamp("us", tz="UTC")),
+    ])
+    fs = s3fs.S3FileSystem()
+    table = pa.Table.from_pydict({k: [v] for k, v in row.items()}, schema=schema)
+    run_date = row["date"]
+    partition_dir = f"{S3_BUCKET}/{S3_PREFIX}/year={run_date.year}/month={run_date.month}/day={run_date.day}"
+    if fs.exists(partition_dir):
+        fs.rm(partition_dir, recursive=True)
+    path = f"{partition_dir}/part-0.parquet"
+    pq.write_table(table, path, filesystem=fs, compression="snappy")
+    print(f"Saved data for {run_date} to S3 at s3://{path}")
+    return f"s3://{path}"
 
 # -------------------------------
 # Main execution
 # -------------------------------
-if name == "main":
+if __name__ == "__main__":
     # CHANGE THIS DATE for each backfill
     target_date = input("Enter date to backfill (YYYY-MM-DD): ").strip()
 
-    df = fetch_bitcoin_data(target_date)
-    print(df[["date", "price_usd", "volume_usd"]])
-    save_to_s3(df)
\ No newline at end of file
+    row = fetch_bitcoin_data(target_date, get_headers())
+    print({k: row[k] for k in ("date", "price_usd", "volume_usd")})
+    save_to_s3(row)
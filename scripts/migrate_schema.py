@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+One-off, lossless migration of the data lake to the PyArrow ETL schema (see the README's
+"Schema migration" section).
+
+Every partition directory under s3://BUCKET/PREFIX/ that still holds old awswrangler files
+(TIMESTAMP `date`, STRING `last_updated`, uuid-named objects) is read, cast to the new types
+and rewritten in place as a single part-0.parquet. No data is re-fetched from CoinGecko.
+
+    python scripts/migrate_schema.py            # rewrite every old-typed partition
+    python scripts/migrate_schema.py --check    # exit 1 if any old-typed partition remains
+
+Requires the same dependencies as lambda_backfill.py (pip install -r scripts/requirements.txt).
+"""
+
+import argparse
+import logging
+import sys
+from typing import Dict, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import s3fs
+
+from lambda_backfill import BUCKET, PREFIX, SCHEMA, _parse_iso8601
+
+# File schema: year/month/day live only in the S3 path
+TARGET_SCHEMA = pa.schema([f for f in SCHEMA if f.name not in ("year", "month", "day")])
+PART_FILE = "part-0.parquet"
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+logger = logging.getLogger("migrate")
+
+def list_partitions(fs: s3fs.S3FileSystem) -> Dict[str, List[str]]:
+    """
+    Maps each partition directory to the data files in it. Names starting with "_" or "."
+    are skipped, as Athena ignores them too.
+    """
+    root_path = f"{BUCKET}/{PREFIX}"
+    partitions: Dict[str, List[str]] = {}
+    for path in (fs.find(root_path) if fs.exists(root_path) else []):
+        directory, name = path.rsplit("/", 1)
+        if not name.startswith(("_", ".")):
+            partitions.setdefault(directory, []).append(path)
+    return partitions
+
+def is_migrated(fs: s3fs.S3FileSystem, files: List[str]) -> bool:
+    if len(files) != 1 or files[0].rsplit("/", 1)[1] != PART_FILE:
+        return False
+    with fs.open(files[0], "rb") as f:
+        return pq.read_schema(f).equals(TARGET_SCHEMA)
+
+def _convert_column(col: pa.ChunkedArray, field: pa.Field) -> pa.ChunkedArray:
+    if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+        if pa.types.is_timestamp(field.type):
+            return pa.chunked_array(
+                [pa.array([_parse_iso8601(s) if s else None for s in col.to_pylist()], type=field.type)],
+                type=field.type
+            )
+        return col.cast(field.type)  # e.g. "YYYY-MM-DD" -> date32
+    if pa.types.is_timestamp(col.type) and pa.types.is_timestamp(field.type) and col.type.tz is None:
+        # awswrangler wrote naive timestamps holding UTC wall-clock values
+        col = col.cast(pa.timestamp(col.type.unit, tz="UTC"))
+    # Old files are nanosecond-precision; dropping sub-microsecond digits is intended
+    return col.cast(field.type, safe=False)
+
+def convert_table(table: pa.Table) -> pa.Table:
+    """
+    Casts an old-layout table to TARGET_SCHEMA. Columns missing from the old file are filled
+    with nulls; in-file year/month/day and any other extra columns are dropped.
+    """
+    columns = []
+    for field in TARGET_SCHEMA:
+        if field.name in table.column_names:
+            columns.append(_convert_column(table[field.name], field))
+        else:
+            columns.append(pa.chunked_array([pa.nulls(table.num_rows, field.type)], type=field.type))
+    return pa.Table.from_arrays(columns, schema=TARGET_SCHEMA)
+
+def _latest_row(table: pa.Table) -> pa.Table:
+    """Keeps the most recently processed row (nulls sort first, so they lose)."""
+    ts = table["processing_timestamp"].to_pylist()
+    best = max(range(len(ts)), key=lambda i: (ts[i] is not None, ts[i] or 0))
+    return table.slice(best, 1)
+
+def migrate_partition(fs: s3fs.S3FileSystem, directory: str, files: List[str], keep_duplicates: bool):
+    tables = []
+    for path in files:
+        with fs.open(path, "rb") as f:
+            tables.append(convert_table(pq.read_table(f)))
+    table = pa.concat_tables(tables)
+    if table.num_rows > 1 and not keep_duplicates:
+        # Each writer produces one row per day; extra rows are the double-counted duplicates
+        logger.warning(f"{directory}: {table.num_rows} rows across {len(files)} files, keeping the latest")
+        table = _latest_row(table)
+
+    buf = pa.BufferOutputStream()
+    pq.write_table(table, buf, compression="snappy")
+    target = f"{directory}/{PART_FILE}"
+    # Write the new file before deleting the old ones so an interrupted run loses nothing
+    fs.pipe(target, buf.getvalue().to_pybytes())
+    old = [p for p in files if p.rsplit("/", 1)[1] != PART_FILE]
+    if old:
+        fs.rm(old)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rewrite old-typed data lake partitions in the PyArrow ETL schema.")
+    parser.add_argument(
+        "--check", action="store_true",
+        help="Only report partitions that still need migrating; exit 1 if there are any."
+    )
+    parser.add_argument(
+        "--keep-duplicates", action="store_true",
+        help="Keep every row of a partition instead of only the latest one."
+    )
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    fs = s3fs.S3FileSystem()
+    partitions = list_partitions(fs)
+    pending = {d: files for d, files in sorted(partitions.items()) if not is_migrated(fs, files)}
+    logger.info(f"{len(partitions)} partitions under s3://{BUCKET}/{PREFIX}, {len(pending)} need migrating")
+
+    if args.check:
+        for directory in pending:
+            logger.error(f"Not migrated: s3://{directory}")
+        sys.exit(1 if pending else 0)
+
+    for directory, files in pending.items():
+        migrate_partition(fs, directory, files, args.keep_duplicates)
+        logger.info(f"Migrated s3://{directory} ({len(files)} files)")
+    logger.info("Migration finished. Run with --check before MSCK REPAIR TABLE.")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 terraform {
-  required_version = ">= 1.0"
+  required_version = ">= 1.2"
 
   backend "local" {
     # For a real project, use a remote backend like S3
@@ -82,6 +82,7 @@ resource "aws_iam_policy" "lambda_policy" {
         Action = [
           "s3:PutObject",
           "s3:GetObject",
+          "s3:DeleteObject",
           "s3:ListBucket"
         ],
         Effect = "Allow",
@@ -146,10 +147,13 @@ resource "null_resource" "docker_build_and_push" {
     dockerfile_hash       = filemd5("${path.module}/../lambda/Dockerfile")
     requirements_txt_hash = filemd5("${path.module}/../lambda/src/requirements.txt")
     lambda_src_hash       = filemd5("${path.module}/../lambda/src/lambda_etl.py")
+    secrets_extension_arn = var.secrets_extension_layer_arn
   }
 
   provisioner "local-exec" {
     command     = <<EOT
+      set -e
+      curl --fail -sSL "$(aws lambda get-layer-version-by-arn --region ${var.aws_region} --arn ${var.secrets_extension_layer_arn} --query Content.Location --output text)" -o ${path.module}/../lambda/secrets-extension.zip
       aws ecr get-login-password --region ${var.aws_region} | docker login --username AWS --password-stdin ${aws_ecr_repository.lambda_repo.repository_url}
       docker build --platform linux/amd64 -t ${aws_ecr_repository.lambda_repo.name} ${path.module}/../lambda
       docker tag ${aws_ecr_repository.lambda_repo.name}:latest ${aws_ecr_repository.lambda_repo.repository_url}:latest
@@ -159,6 +163,13 @@ resource "null_resource" "docker_build_and_push" {
   }
 
   depends_on = [aws_ecr_repository.lambda_repo]
+
+  lifecycle {
+    precondition {
+      condition     = split(":", var.secrets_extension_layer_arn)[3] == var.aws_region
+      error_message = "secrets_extension_layer_arn must be the Parameters and Secrets Lambda Extension layer for var.aws_region; the layer's account ID and version differ per region (see the extension's ARN list in the AWS Secrets Manager docs)."
+    }
+  }
 }
 
 #------------------------------------------------------------------------------
@@ -181,6 +192,7 @@ resource "aws_lambda_function" "etl_function" {
       S3_PREFIX                     = "raw/coingecko"
       FILE_FORMAT                   = "parquet"
       COINGECKO_API_KEY_SECRET_NAME = var.coingecko_api_key_secret_arn
+      SECRETS_MANAGER_TTL           = "300"
     }
   }
 
@@ -20,6 +20,14 @@ variable "coingecko_api_key_secret_arn" {
   type        = string
 }
 
+variable "secrets_extension_layer_arn" {
+  # The default is the us-east-1 x86_64 layer. AWS publishes this layer from a different account
+  # per region, so the ARN can't be derived from aws_region; set it whenever aws_region changes.
+  description = "ARN of the AWS Parameters and Secrets Lambda Extension layer baked into the ETL image. Must be in var.aws_region."
+  type        = string
+  default     = "arn:aws:lambda:us-east-1:177933569100:layer:AWS-Parameters-and-Secrets-Lambda-Extension:11"
+}
+
 variable "athena_database" {
   description = "Name of the Athena database containing bitcoin_daily"
   type        = string